@@ -318,11 +318,14 @@ def inventory(details, _list, sync, filter):
         if _list
         else settings.settings.inventory_fields
     )
+    # flip the provider actions once, instead of for every host
+    flipped_actions = helpers.flip_provider_actions(PROVIDER_ACTIONS)
     curated_host_info = [
         helpers.inventory_fields_to_dict(
             inventory_fields=inventory_fields,
             host_dict=host,
             provider_actions=PROVIDER_ACTIONS,
+            flipped_actions=flipped_actions,
         )
         for host in inventory
     ]
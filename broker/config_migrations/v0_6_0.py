@@ -4,11 +4,20 @@ from logzero import logger
 
 TO_VERSION = "0.6.0"
 
+# (new key, old top-level key, default) for settings moved into the ssh section
+SSH_FIELDS = (
+    ("backend", "ssh_backend", "ssh2-python312"),
+    ("host_username", "host_username", "root"),
+    ("host_password", "host_password", "toor"),
+    ("host_ipv6", "host_ipv6", False),
+    ("host_ipv4_fallback", "host_ipv4_fallback", True),
+)
+
 
 def migrate_instances(config_dict):
     """Migrate instances from a list of dicts to a dict of dicts."""
     logger.debug("Migrating instances from a list to a dict.")
-    for key, val in config_dict.items():
+    for val in config_dict.values():
         if not isinstance(val, dict):
             continue
         if "instances" in val and isinstance(val["instances"], list):
@@ -16,7 +25,6 @@ def migrate_instances(config_dict):
             val["instances"] = {}
             for inst in old_instances:
                 val["instances"].update(inst)
-        config_dict[key] = val
     return config_dict
 
 
@@ -43,11 +51,7 @@ def move_ssh_settings(config_dict):
         return config_dict
     logger.debug("Moving SSH settings into their own section.")
     ssh_settings = {
-        "backend": config_dict.pop("ssh_backend", "ssh2-python312"),
-        "host_username": config_dict.pop("host_username", "root"),
-        "host_password": config_dict.pop("host_password", "toor"),
-        "host_ipv6": config_dict.pop("host_ipv6", False),
-        "host_ipv4_fallback": config_dict.pop("host_ipv4_fallback", True),
+        new_key: config_dict.pop(old_key, default) for new_key, old_key, default in SSH_FIELDS
     }
     if ssh_port := config_dict.pop("host_ssh_port", None):
         ssh_settings["ssh_port"] = ssh_port
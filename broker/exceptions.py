@@ -11,10 +11,11 @@ class BrokerError(Exception):
 
     def __init__(self, message="An unhandled exception occured!"):
         # Log the exception if the logger is set to DEBUG
-        if logger.level == logging.DEBUG and isinstance(message, Exception):
+        if isinstance(message, Exception) and logger.isEnabledFor(logging.DEBUG):
             logger.exception(message)
         self.message = message
-        logger.error(f"{self.__class__.__name__}: {self.message}")
+        if logger.isEnabledFor(logging.ERROR):
+            logger.error("%s: %s", type(self).__name__, self.message)
 
 
 class AuthenticationError(BrokerError):
@@ -35,8 +36,7 @@ class ProviderError(BrokerError):
     error_code = 7
 
     def __init__(self, provider=None, message="Unspecified exception"):
-        self.message = f"{provider} encountered the following error: {message}"
-        super().__init__(message=self.message)
+        super().__init__(message=f"{provider} encountered the following error: {message}")
 
 
 class ConfigurationError(BrokerError):
@@ -58,8 +58,8 @@ class HostError(BrokerError):
 
     def __init__(self, host=None, message="Unspecified exception"):
         if host:
-            self.message = f"{host.hostname or host.name}: {message}"
-        super().__init__(message=self.message)
+            message = f"{host.hostname or host.name}: {message}"
+        super().__init__(message=message)
 
 
 class ContainerBindError(BrokerError):
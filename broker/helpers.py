@@ -1,18 +1,21 @@
 """Miscellaneous helpers live here."""
 
-import collections
 from collections import UserDict, namedtuple
 from collections.abc import MutableMapping
-from contextlib import contextmanager
+from contextlib import contextmanager, suppress
 from copy import deepcopy
+from functools import lru_cache
 import getpass
-import inspect
-from io import BytesIO
+from io import StringIO
+from itertools import chain
 import json
+import logging
 import os
 from pathlib import Path
+import re
 import sys
 import tarfile
+import tempfile
 import threading
 import time
 from uuid import uuid4
@@ -24,12 +27,31 @@ from ruamel.yaml import YAML
 
 from broker import exceptions, logger as b_log, settings
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock, so FileLock falls back to msvcrt
+    fcntl = None
+    import msvcrt
+
 FilterTest = namedtuple("FilterTest", "haystack needle test")
 INVENTORY_LOCK = threading.Lock()
+FILE_SUFFIXES = (".json", ".yaml", ".yml")  # file types that load_file can read
+TIMEOUT_UNITS_MS = {"s": 1000, "m": 60_000, "h": 3_600_000, "d": 86_400_000}
+# every json document, including bare scalars and NaN/Infinity, starts with one of these
+JSON_START_CHARS = frozenset('{["-0123456789tfnNI')
+TAR_BUFFER_SIZE = 1024 * 1024  # write size used when streaming temporary tar files
 
 yaml = YAML()
 yaml.default_flow_style = False
 yaml.sort_keys = False
+# plain data loads don't need round-trip metadata, so use the faster safe loader
+# ruamel will use its libyaml-based C parser when ruamel.yaml.clib is installed
+_safe_yaml = YAML(typ="safe")
 
 SPECIAL_INVENTORY_FIELDS = {}  # use the _special_inventory_field decorator to add new fields
 
@@ -49,23 +71,38 @@ def clean_dict(in_dict):
     return {k: v for k, v in in_dict.items() if v is not None}
 
 
+def _is_mapping(obj):
+    """Check for a mutable mapping, with a fast path for plain dicts before the ABC check."""
+    return type(obj) is dict or isinstance(obj, MutableMapping)
+
+
 def merge_dicts(dict1, dict2):
     """Merge two nested dictionaries together.
 
+    Values only present in one of the dictionaries are shared with the result, not copied.
+
     :return: merged dictionary
     """
-    if not isinstance(dict1, MutableMapping) or not isinstance(dict2, MutableMapping):
+    if not _is_mapping(dict1) or not _is_mapping(dict2):
         return dict1
-    dict1 = clean_dict(dict1)
-    dict2 = clean_dict(dict2)
     merged = {}
-    dupe_keys = dict1.keys() & dict2.keys()
-    for key in dupe_keys:
-        merged[key] = merge_dicts(dict1[key], dict2[key])
-    for key in dict1.keys() - dupe_keys:
-        merged[key] = deepcopy(dict1[key])
-    for key in dict2.keys() - dupe_keys:
-        merged[key] = deepcopy(dict2[key])
+    # walk the nested levels with a stack of (output, dict1, dict2) instead of recursing
+    stack = [(merged, dict1, dict2)]
+    while stack:
+        out, left, right = stack.pop()
+        # None values are skipped in place, rather than building cleaned copies of each level
+        for key, val in left.items():
+            if val is None:
+                continue
+            other = right.get(key)
+            if other is not None and _is_mapping(val) and _is_mapping(other):
+                out[key] = {}
+                stack.append((out[key], val, other))
+            else:
+                out[key] = val
+        for key, val in right.items():
+            if val is not None and key not in out:
+                out[key] = val
     return merged
 
 
@@ -90,25 +127,28 @@ def flatten_dict(nested_dict, parent_key="", separator="_"):
 
     :return: dictionary
     """
-    flattened = []
-    for key, value in nested_dict.items():
-        new_key = f"{parent_key}{separator}{key}" if parent_key else key
-        if isinstance(value, dict):
-            flattened.extend(flatten_dict(value, new_key, separator).items())
-        elif isinstance(value, list):
-            to_remove = []
-            # avoid mutating nested structures
-            value = value.copy()  # noqa: PLW2901
-            for index, val in enumerate(value):
-                if isinstance(val, dict):
-                    flattened.extend(flatten_dict(val, new_key, separator).items())
-                    to_remove.append(index)
-            for index in to_remove[::-1]:  # remove from back to front
-                del value[index]
-            flattened.append((new_key, value))
+    flattened = {}
+    # depth-first walk using a stack of (key prefix, items iterator, list entry to set when done)
+    stack = [(parent_key, iter(nested_dict.items()), None)]
+    while stack:
+        prefix, items, list_entry = stack[-1]
+        for key, value in items:
+            new_key = f"{prefix}{separator}{key}" if prefix else key
+            if isinstance(value, dict):
+                stack.append((new_key, iter(value.items()), None))
+                break
+            if isinstance(value, list) and any(isinstance(val, dict) for val in value):
+                # flatten the nested dictionaries first, then set the remaining list
+                nested = (val.items() for val in value if isinstance(val, dict))
+                kept = [val for val in value if not isinstance(val, dict)]
+                stack.append((new_key, chain.from_iterable(nested), (new_key, kept)))
+                break
+            flattened[new_key] = value
         else:
-            flattened.append((new_key, value))
-    return dict(flattened)
+            stack.pop()
+            if list_entry:
+                flattened[list_entry[0]] = list_entry[1]
+    return flattened
 
 
 def dict_from_paths(source_dict, paths, sep="/"):
@@ -135,35 +175,55 @@ def dict_from_paths(source_dict, paths, sep="/"):
     """
     result = {}
     for key, path in paths.items():
-        if sep not in path:
-            result[key] = source_dict.get(path)
-        else:
-            top, rem = path.split(sep, 1)
-            result.update(dict_from_paths(source_dict[top], {key: rem}))
+        *parents, last = path.split(sep)
+        current = source_dict
+        for part in parents:
+            current = current[part]
+        result[key] = current.get(last)
     return result
 
 
-def eval_filter(filter_list, raw_filter, filter_key="inv"):
-    """Run each filter through an eval to get the results."""
-    filter_list = [MockStub(item) if isinstance(item, dict) else item for item in filter_list]
+@lru_cache(maxsize=256)
+def _compile_filter(expr):
+    """Compile a filter expression, reusing the result for repeated filters."""
+    return compile(expr, "<filter>", "eval")
+
+
+def _iter_filter(filter_list, raw_filter, filter_key="inv"):
+    """Lazily yield the items of filter_list that pass each filter in raw_filter."""
+    items, wrapped = filter_list, False
+    token, list_token = f"@{filter_key}", f"@{filter_key}["
     for raw_f in raw_filter.split("|"):
-        if f"@{filter_key}[" in raw_f:
-            # perform a list filter on the inventory
-            filter_list = eval(  # noqa: S307
-                raw_f.replace(f"@{filter_key}", filter_key), {filter_key: filter_list}
-            )
-            filter_list = filter_list if isinstance(filter_list, list) else [filter_list]
-        elif f"@{filter_key}" in raw_f:
-            # perform an attribute filter on each host
-            filter_list = list(
-                filter(
-                    lambda item: eval(  # noqa: S307
-                        raw_f.replace(f"@{filter_key}", filter_key), {filter_key: item}
-                    ),
-                    filter_list,
-                )
+        if token not in raw_f:
+            continue
+        expr = raw_f.replace(token, filter_key).strip()
+        # plain indexes and slices like @inv[-1] work on the raw dicts, so only wrap hosts
+        # in MockStub once a filter may actually rely on its attribute access
+        if not wrapped and not re.fullmatch(rf"{filter_key}\[[^\[\].]*\]", expr):
+            items = (MockStub(item) if isinstance(item, dict) else item for item in items)
+            wrapped = True
+        if list_token in raw_f:
+            # perform a list filter on the inventory, this needs the full list
+            items = eval(expr, {filter_key: list(items)})  # noqa: S307
+            items = items if isinstance(items, list) else [items]
+        else:
+            # perform an attribute filter on each host, compiling the expression only once
+            code = _compile_filter(expr)
+            items = filter(
+                lambda item, code=code: eval(code, {filter_key: item}),  # noqa: S307
+                items,
             )
-    return [dict(item) if isinstance(item, MockStub) else item for item in filter_list]
+    for item in items:
+        # copy from MockStub.data, since a host key like "keys" shadows the mapping methods
+        if isinstance(item, MockStub):
+            yield dict(item.data)
+        else:
+            yield dict(item) if isinstance(item, dict) else item
+
+
+def eval_filter(filter_list, raw_filter, filter_key="inv"):
+    """Run each filter through an eval to get the results."""
+    return list(_iter_filter(filter_list, raw_filter, filter_key))
 
 
 def resolve_nick(nick):
@@ -174,21 +234,41 @@ def resolve_nick(nick):
     :return: a dictionary mapping argument names and values
     """
     nick_names = settings.settings.get("NICKS") or {}
-    if nick in nick_names:
-        return settings.settings.NICKS[nick].to_dict()
+    if (nick_settings := nick_names.get(nick)) is not None:
+        return nick_settings.to_dict()
 
 
 def load_file(file, warn=True):
     """Verify the existence of and load data from json and yaml files."""
     file = Path(file)
-    if not file.exists() or file.suffix not in (".json", ".yaml", ".yml"):
+    stat = None
+    if file.suffix in FILE_SUFFIXES:
+        # a single stat doubles as the existence check
+        with suppress(OSError):
+            stat = file.stat()
+    if stat is None:
         if warn:
             logger.warning(f"File {file.absolute()} is invalid or does not exist.")
         return []
+    # the stat info is part of the cache key, so edited or replaced files are parsed again
+    data = _parse_file(file.absolute(), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    # callers are free to modify what they get back, so never hand out the cached object
+    return deepcopy(data)
+
+
+@lru_cache(maxsize=32)
+def _parse_file(file, inode, mtime_ns, size):
+    """Parse a json or yaml file. Cached on the file's path and stat info by load_file."""
     if file.suffix == ".json":
-        return json.loads(file.read_text())
+        # both parsers take the raw bytes, skipping a separate decode step
+        return (orjson.loads if orjson else json.loads)(file.read_bytes())
     elif file.suffix in (".yaml", ".yml"):
-        return yaml.load(file)
+        return _safe_yaml.load(file)
+
+
+def _looks_like_file(val):
+    """Check whether an argument value should be treated as a file for load_file."""
+    return isinstance(val, Path) or (isinstance(val, str) and val.endswith(FILE_SUFFIXES))
 
 
 def resolve_file_args(broker_args):
@@ -199,7 +279,7 @@ def resolve_file_args(broker_args):
     final_args = {}
     # parse the eventual args_file first
     if val := broker_args.pop("args_file", None):
-        if isinstance(val, Path) or (isinstance(val, str) and val[-4:] in ("json", "yaml", ".yml")):
+        if _looks_like_file(val):
             if data := load_file(val):
                 if isinstance(data, dict):
                     final_args.update(data)
@@ -210,13 +290,13 @@ def resolve_file_args(broker_args):
                 raise exceptions.BrokerError(f"No data loaded from {val}")
 
     for key, val in broker_args.items():
-        if isinstance(val, Path) or (isinstance(val, str) and val[-4:] in ("json", "yaml", ".yml")):
+        if _looks_like_file(val):
             if data := load_file(val):
-                final_args.update({key: data})
+                final_args[key] = data
             else:
-                final_args.update({key: val})
+                final_args[key] = val
         else:
-            final_args.update({key: val})
+            final_args[key] = val
     return final_args
 
 
@@ -246,25 +326,52 @@ def update_inventory(add=None, remove=None):
         remove = [remove]
     with INVENTORY_LOCK:
         inv_data = load_inventory()
-        if inv_data:
-            settings.inventory_path.unlink()
 
         if remove:
-            for host in inv_data[::-1]:
-                if host["hostname"] in remove or host.get("name") in remove:
+            remove, kept = set(remove), []
+            # a None in remove comes from a host checked in without a hostname. It must only
+            # match hosts that can't be identified either, not every host lacking one field
+            remove_unnamed = None in remove
+            remove.discard(None)
+            for host in reversed(inv_data):
+                hostname, name = host.get("hostname"), host.get("name")
+                if (
+                    hostname in remove
+                    or name in remove
+                    or (remove_unnamed and hostname is None and name is None)
+                ):
                     # iterate through new hosts and update with old host data if it would nullify
                     for new_host in add:
-                        if host["hostname"] == new_host["hostname"] or host.get(
-                            "name"
-                        ) == new_host.get("name"):
+                        if (hostname is not None and hostname == new_host.get("hostname")) or (
+                            name is not None and name == new_host.get("name")
+                        ):
                             # update missing data in the new_host with the old_host data
                             new_host.update(merge_dicts(new_host, host))
-                    inv_data.remove(host)
+                else:
+                    kept.append(host)
+            inv_data = kept[::-1]
         if add:
             inv_data.extend(add)
 
-        settings.inventory_path.touch()
-        yaml.dump(inv_data, settings.inventory_path)
+        # write to a uniquely named temporary file first, so the inventory is never left
+        # empty or partial, even when several processes update it at once
+        inventory_path = settings.inventory_path
+        try:
+            mode = inventory_path.stat().st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        temp_file = tempfile.NamedTemporaryFile(
+            "w", dir=inventory_path.parent, prefix=f".{inventory_path.name}.", delete=False
+        )
+        temp_path = Path(temp_file.name)
+        try:
+            with temp_file:
+                yaml.dump(inv_data, temp_file)
+            temp_path.chmod(mode)
+            temp_path.replace(inventory_path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
 
 
 def yaml_format(in_struct, force_yaml_dict=False):
@@ -276,17 +383,20 @@ def yaml_format(in_struct, force_yaml_dict=False):
     :return: yaml-formatted string
     """
     if isinstance(in_struct, str):
-        # first try to load is as json
-        try:
-            in_struct = json.loads(in_struct)
-        except json.JSONDecodeError:
+        loaded, is_json = None, False
+        # first try to load it as json, skipping the attempt when json can't possibly parse it
+        if in_struct.lstrip()[:1] in JSON_START_CHARS:
+            with suppress(json.JSONDecodeError):
+                loaded, is_json = json.loads(in_struct), True
+        if not is_json:
             # then try yaml
-            in_struct = yaml.load(in_struct)
+            loaded = yaml.load(in_struct)
             if force_yaml_dict:
-                in_struct = dict(in_struct)
-    output = BytesIO()  # ruamel doesn't natively allow for string output
+                loaded = dict(loaded)
+        in_struct = loaded
+    output = StringIO()  # dump straight to text, no bytes buffer to decode afterwards
     yaml.dump(in_struct, output)
-    return output.getvalue().decode("utf-8")
+    return output.getvalue()
 
 
 def flip_provider_actions(provider_actions):
@@ -331,36 +441,51 @@ def inventory_fields_to_dict(inventory_fields, host_dict, **extras):
 
 
 def _resolve_inv_field(field, host_dict, **extras):
-    """Real functionality for inventory_fields_to_dict, allows recursive evaluation."""
+    """Real functionality for inventory_fields_to_dict."""
+    return _compile_inv_field(field)(host_dict, **extras)
+
+
+@lru_cache(maxsize=128)
+def _compile_inv_field(field):
+    """Parse an inventory field once into a function that resolves it for a host."""
     # Users can specify multiple values to try in order of priority, so evaluate each
     if "|" in field:
-        resolved = [_resolve_inv_field(f.strip(), host_dict, **extras) for f in field.split("|")]
-        for val in resolved:
-            if val and val != "Unknown":
-                return val
-        return "Unknown"
+        options = [_compile_inv_field(f.strip()) for f in field.split("|")]
+
+        def resolve_first(host_dict, **extras):
+            for option in options:
+                if (val := option(host_dict, **extras)) and val != "Unknown":
+                    return val
+            return "Unknown"
+
+        return resolve_first
     # Users can combine multiple values in a single field, so evaluate each
     if " " in field:
-        return " ".join(_resolve_inv_field(f, host_dict, **extras) for f in field.split())
-    # Some field values require special handling beyond what the existing syntax allows
-    if special_field_func := SPECIAL_INVENTORY_FIELDS.get(field):
-        return special_field_func(host_dict, **extras)
-    # Otherwise, try to get the value from the host dictionary
-    return dict_from_paths(host_dict, {"_": field}, sep=".")["_"] or "Unknown"
+        parts = [_compile_inv_field(f) for f in field.split()]
+        return lambda host_dict, **extras: " ".join(part(host_dict, **extras) for part in parts)
+
+    def resolve_single(host_dict, **extras):
+        # Some field values require special handling beyond what the existing syntax allows.
+        # Looked up per call, so fields registered after this spec was compiled still apply
+        if special_field_func := SPECIAL_INVENTORY_FIELDS.get(field):
+            return special_field_func(host_dict, **extras)
+        # Otherwise, try to get the value from the host dictionary
+        return dict_from_paths(host_dict, {"_": field}, sep=".")["_"] or "Unknown"
+
+    return resolve_single
 
 
 @_special_inventory_field("$action")
-def get_host_action(host_dict, provider_actions=None, **_):
-    """Get a more focused set of fields from the host inventory."""
-    if not provider_actions:
-        return "$actionError"
-    # Flip the mapping of actions->provider to provider->actions
-    flipped_actions = {}
-    for action, (provider, _) in provider_actions.items():
-        provider_name = provider.__name__
-        if provider_name not in flipped_actions:
-            flipped_actions[provider_name] = []
-        flipped_actions[provider_name].append(action)
+def get_host_action(host_dict, provider_actions=None, flipped_actions=None, **_):
+    """Get a more focused set of fields from the host inventory.
+
+    Callers resolving many hosts can pass the result of flip_provider_actions
+    as flipped_actions, so it isn't rebuilt for each host.
+    """
+    if flipped_actions is None:
+        if not provider_actions:
+            return "$actionError"
+        flipped_actions = flip_provider_actions(provider_actions)
     # Get the host's action, based on its provider
     provider = host_dict["_broker_provider"]
     for opt in flipped_actions[provider]:
@@ -372,19 +497,21 @@ def get_host_action(host_dict, provider_actions=None, **_):
 def kwargs_from_click_ctx(ctx):
     """Convert a Click context object to a dictionary of keyword arguments."""
     # if users use `=` to note arg=value assignment, then we need to split it
-    _args = []
-    for arg in ctx.args:
-        if "=" in arg:
-            _args.extend(arg.split("="))
-        else:
-            _args.append(arg)
-    ctx.args = _args
+    tokens = iter(
+        chain.from_iterable(arg.split("=", 1) if "=" in arg else (arg,) for arg in ctx.args)
+    )
     # if additional arguments were passed, include them in the broker args
     # strip leading -- characters
-    return {
-        (key[2:] if key.startswith("--") else key): val
-        for key, val in zip(ctx.args[::2], ctx.args[1::2])
-    }
+    return {key.removeprefix("--"): val for key, val in zip(tokens, tokens)}
+
+
+def _dump_json(data):
+    """Serialize data to indented, key-sorted json bytes, using orjson when it is installed."""
+    if orjson:
+        return orjson.dumps(
+            data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(data, indent=4, sort_keys=True).encode("utf-8")
 
 
 class Emitter:
@@ -403,8 +530,10 @@ class Emitter:
     def __init__(self, emit_file=None):
         """Can empty init and set the file later."""
         self.file = None
+        # in-memory copy of the emitted data, so we never have to read the file back
+        self._data = {}
         if emit_file:
-            self.file = self.set_file(emit_file)
+            self.set_file(emit_file)
 
     def set_file(self, file_path):
         """Set the file to emit to."""
@@ -414,6 +543,7 @@ class Emitter:
             if self.file.exists():
                 self.file.unlink()
             self.file.touch()
+            self._data = {}
 
     def emit_to_file(self, *args, **kwargs):
         """Emit data to the file, keeping existing data in-place."""
@@ -427,9 +557,17 @@ class Emitter:
             if getattr(kwargs[key], "json", None):
                 kwargs[key] = kwargs[key].json
         with self.EMIT_LOCK:
-            curr_data = json.loads(self.file.read_text() or "{}")
-            curr_data.update(kwargs)
-            self.file.write_text(json.dumps(curr_data, indent=4, sort_keys=True))
+            # the state holds copies, so values changed in place by the caller still compare as new
+            if kwargs.items() <= self._data.items():
+                return  # nothing new to write
+            new_data = {**self._data, **deepcopy(kwargs)}
+            # serialize before touching any state, so a bad emission fails only its own call
+            dumped = _dump_json(new_data)
+            # replace the file in one step, so readers never see partially written json
+            temp_file = self.file.with_suffix(f"{self.file.suffix}.tmp")
+            temp_file.write_bytes(dumped)
+            temp_file.replace(self.file)
+            self._data = new_data
 
     def __call__(self, *args, **kwargs):
         """Allow emit to be used like a function."""
@@ -439,43 +577,64 @@ class Emitter:
 emit = Emitter()
 
 
+_SEQUENCE_TYPES = frozenset({list, tuple})
+
+
+@lru_cache(maxsize=None)
+def _class_members(cls):
+    """Return the attribute names defined on a class, used by MockStub to spot colliding keys."""
+    return frozenset(dir(cls))
+
+
 class MockStub(UserDict):
     """Test helper class. Allows for both arbitrary mocking and stubbing."""
 
     def __init__(self, in_dict=None):
-        """Initialize the class and all nested dictionaries."""
-        if in_dict is None:
-            in_dict = {}
-        for key, value in in_dict.items():
-            if isinstance(value, dict):
-                setattr(self, key, MockStub(value))
-            elif type(value) in (list, tuple):
-                setattr(
-                    self,
-                    key,
-                    [MockStub(x) if isinstance(x, dict) else x for x in value],
-                )
-            else:
-                setattr(self, key, value)
-        super().__init__(in_dict)
+        """Initialize the class. Nested dictionaries are wrapped when first accessed."""
+        super().__init__(in_dict or {})
+        # keys named like a class member (items, keys, get, ...) never reach __getattr__,
+        # so set those right away to keep the data value shadowing the member
+        for key in self.data.keys() & _class_members(type(self)):
+            setattr(self, key, self._wrap(self.data[key]))
+
+    @staticmethod
+    def _wrap(value):
+        """Wrap dictionaries, including those nested in lists and tuples, in MockStub."""
+        if isinstance(value, dict):
+            return MockStub(value)
+        if type(value) in _SEQUENCE_TYPES:
+            return [MockStub(x) if isinstance(x, dict) else x for x in value]
+        return value
 
     def __getattr__(self, name):
-        """Fallback to returning self if attribute doesn't exist."""
-        return self
+        """Return the matching value, wrapping nested structures, or fall back to self."""
+        data = self.__dict__.get("data")
+        if data is None or name not in data:
+            return self
+        value = self._wrap(data[name])
+        if value is not data[name]:
+            # cache the wrapped value so later lookups don't wrap it again
+            setattr(self, name, value)
+        return value
 
     def __getitem__(self, key):
         """Get an item from the dictionary-like object.
 
-        If the key is a string, this method will attempt to get an attribute with that name.
         If the key is not found, this method will return the object itself.
         """
-        if isinstance(key, str):
-            item = getattr(self, key, self)
-        try:
-            item = super().__getitem__(key)
-        except KeyError:
-            item = self
-        return item
+        if key in self.data:
+            return self.data[key]
+        return self
+
+    def __setitem__(self, key, value):
+        """Set an item, dropping any cached hash."""
+        self.__dict__.pop("_hash", None)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        """Delete an item, dropping any cached hash."""
+        self.__dict__.pop("_hash", None)
+        super().__delitem__(key)
 
     def __call__(self, *args, **kwargs):
         """Allow MockStub to be used like a function."""
@@ -484,11 +643,20 @@ class MockStub(UserDict):
     def __hash__(self):
         """Return a hash value for the object.
 
-        The hash value is computed using the hash value of all hashable attributes of the object.
+        The hash value is computed using the hash value of all hashable values of the object.
+        It is cached until an item is set or deleted.
         """
-        return hash(
-            tuple(kp for kp in self.__dict__.items() if isinstance(kp[1], collections.abc.Hashable))
-        )
+        if (cached := self.__dict__.get("_hash")) is not None:
+            return cached
+        hashable = []
+        for key, value in self.data.items():
+            try:
+                hash(value)
+            except TypeError:
+                continue
+            hashable.append((key, value))
+        self._hash = hash(tuple(hashable))
+        return self._hash
 
 
 def update_log_level(ctx, param, value):
@@ -543,18 +711,7 @@ def translate_timeout(timeout):
     acceptable units are (s)econds, (m)inutes, (h)ours, (d)ays
     """
     if isinstance(timeout, str):
-        timeout, unit = int(timeout[:-1]), timeout[-1]
-        if unit == "d":
-            timeout *= 24
-            unit = "h"
-        if unit == "h":
-            timeout *= 60
-            unit = "m"
-        if unit == "m":
-            timeout *= 60
-            unit = "s"
-        if unit == "s":
-            timeout *= 1000
+        timeout = int(timeout[:-1]) * TIMEOUT_UNITS_MS.get(timeout[-1], 1)
     return timeout if isinstance(timeout, int) else 0
 
 
@@ -562,18 +719,19 @@ def simple_retry(cmd, cmd_args=None, cmd_kwargs=None, max_timeout=60, _cur_timeo
     """Re(Try) a function given its args and kwargs up until a max timeout."""
     cmd_args = cmd_args if cmd_args else []
     cmd_kwargs = cmd_kwargs if cmd_kwargs else {}
-    try:
-        return cmd(*cmd_args, **cmd_kwargs)
-    except Exception as err:  # noqa: BLE001 - Could be anything
-        new_wait = _cur_timeout * 2
-        if new_wait > max_timeout:
-            raise err
-        logger.warning(
-            f"Tried {cmd=} with {cmd_args=}, {cmd_kwargs=} but received {err=}"
-            f"\nTrying again in {_cur_timeout} seconds."
-        )
-        time.sleep(_cur_timeout)
-        simple_retry(cmd, cmd_args, cmd_kwargs, max_timeout, new_wait)
+    while True:
+        try:
+            return cmd(*cmd_args, **cmd_kwargs)
+        except Exception as err:  # noqa: BLE001 - Could be anything
+            new_wait = _cur_timeout * 2
+            if new_wait > max_timeout:
+                raise
+            logger.warning(
+                f"Tried {cmd=} with {cmd_args=}, {cmd_kwargs=} but received {err=}"
+                f"\nTrying again in {_cur_timeout} seconds."
+            )
+            time.sleep(_cur_timeout)
+            _cur_timeout = new_wait
 
 
 class FileLock:
@@ -585,27 +743,54 @@ class FileLock:
         Path("basic_file.txt").write_text("some text")
 
     If a lock is already in place, FileLock will wait up to <timeout> seconds
+
+    The lock itself is an OS-level lock (flock, or msvcrt.locking on Windows) held on
+    <file_name>.lock, so it is released by the OS even if the holding process dies.
+    The .lock file is left in place after release. Older broker versions treat its mere
+    existence as a held lock, so they can't share lock files with this one.
     """
 
     def __init__(self, file_name, timeout=10):
         self.lock = Path(f"{file_name}.lock")
         self.timeout = timeout
+        self._lock_file = None
 
     def wait_file(self):
-        """Wait for the lock file to be released, then acquire it."""
+        """Wait for the lock to be released, then acquire it."""
         timeout_after = time.time() + self.timeout
-        while self.lock.exists():
-            if time.time() <= timeout_after:
-                time.sleep(1)
-            else:
-                raise exceptions.BrokerError(
-                    f"Timeout while waiting for lock release: {self.lock.absolute()}"
-                )
-        self.lock.touch()
+        self._lock_file = self.lock.open("a")
+        wait = 0.001
+        while True:
+            try:
+                self._lock()
+                return
+            except OSError:
+                if time.time() > timeout_after:
+                    self._lock_file.close()
+                    self._lock_file = None
+                    raise exceptions.BrokerError(
+                        f"Timeout while waiting for lock release: {self.lock.absolute()}"
+                    ) from None
+                time.sleep(wait)
+                wait = min(wait * 2, 0.5)
+
+    def _lock(self):
+        """Try to take the lock without blocking, raising OSError if it is held elsewhere."""
+        if fcntl:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            self._lock_file.seek(0)
+            msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_NBLCK, 1)
 
     def return_file(self):
-        """Release the lock file."""
-        self.lock.unlink()
+        """Release the lock."""
+        if fcntl:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        else:
+            self._lock_file.seek(0)
+            msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._lock_file.close()
+        self._lock_file = None
 
     def __enter__(self):  # noqa: D105
         self.wait_file()
@@ -673,26 +858,30 @@ def find_origin():
 
     Additionally, return the jenkins url, if it exists.
     """
-    prev, jenkins_url = None, os.environ.get("BUILD_URL")
-    for frame in inspect.stack():
-        if frame.function == "checkout" and frame.filename.endswith("broker/commands.py"):
+    prev, prev_frame, jenkins_url = None, None, os.environ.get("BUILD_URL")
+    # walk the raw frame chain, since inspect.stack() reads source context for every frame
+    frame = sys._getframe(1)
+    while frame is not None:
+        function, filename = frame.f_code.co_name, frame.f_code.co_filename
+        if function == "checkout" and filename.endswith("broker/commands.py"):
             return f"broker_cli:{getpass.getuser()}", jenkins_url
-        if frame.function.startswith("test_"):
-            return f"{frame.function}:{frame.filename}", jenkins_url
-        if frame.function == "call_fixture_func":
+        if function.startswith("test_"):
+            return f"{function}:{filename}", jenkins_url
+        if function == "call_fixture_func":
             # attempt to find the test name from the fixture's request object
-            if request := _frame.frame.f_locals.get("request"):  # noqa: F821
+            if prev_frame and (request := prev_frame.f_locals.get("request")):
                 return f"{prev} for {request.node._nodeid}", jenkins_url
             # otherwise, return the fixture name and filename
             return prev or "Uknown fixture", jenkins_url
-        prev, _frame = f"{frame.function}:{frame.filename}", frame
+        prev, prev_frame = f"{function}:{filename}", frame
+        frame = frame.f_back
     return f"Unknown origin by {getpass.getuser()}", jenkins_url
 
 
 @contextmanager
 def data_to_tempfile(data, path=None, as_tar=False):
     """Write data to a temporary file and return the path."""
-    path = Path(path or uuid4().hex[-10])
+    path = Path(path or uuid4().hex[-10:])
     logger.debug(f"Creating temporary file {path.absolute()}")
     if isinstance(data, bytes):
         path.write_bytes(data)
@@ -700,24 +889,29 @@ def data_to_tempfile(data, path=None, as_tar=False):
         path.write_text(data)
     else:
         raise TypeError(f"data must be bytes or str, not {type(data)}")
-    if as_tar:
-        tar = tarfile.open(path)
-        yield tarfile.open(path)
-        tar.close()
-    else:
-        yield path
-    path.unlink()
+    try:
+        if as_tar:
+            with tarfile.open(path) as tar:
+                yield tar
+        else:
+            yield path
+    finally:
+        path.unlink(missing_ok=True)
 
 
 @contextmanager
 def temporary_tar(paths):
     """Create a temporary tar file and return the path."""
-    temp_tar = Path(f"{uuid4().hex[-10]}.tar")
-    with tarfile.open(temp_tar, mode="w") as tar:
+    temp_tar = Path(f"{uuid4().hex[-10:]}.tar")
+    tar_path = temp_tar.absolute()
+    log_adds = logger.isEnabledFor(logging.DEBUG)
+    # stream the archive out in large blocks instead of tarfile's default 10KiB records
+    with tarfile.open(temp_tar, mode="w|", bufsize=TAR_BUFFER_SIZE) as tar:
         for path in paths:
-            logger.debug(f"Adding {path.absolute()} to {temp_tar.absolute()}")
+            if log_adds:
+                logger.debug(f"Adding {path.absolute()} to {tar_path}")
             tar.add(path, arcname=path.name)
-    yield temp_tar.absolute()
+    yield tar_path
     temp_tar.unlink()
 
 
@@ -731,14 +925,17 @@ def dictlist_to_table(dict_list, title=None, _id=False):
     if _id:  # likely just for inventory tables
         table.add_column("Id", justify="left", style=column_colors[curr_color], no_wrap=True)
         curr_color += 1
-    for key in dict_list[0]:  # assume all dicts have the same keys
+    keys = list(dict_list[0])  # assume all dicts have the same keys
+    for key in keys:
         table.add_column(key, justify="left", style=column_colors[curr_color])
         curr_color += 1
         if curr_color >= len(column_colors):
             curr_color = 0
-    # add the rows
+    # add the rows, looking values up by column so each lands under the right header
     for id_num, data_dict in enumerate(dict_list):
-        row = [str(id_num)] if _id else []
-        row.extend([str(value) for value in data_dict.values()])
-        table.add_row(*row)
+        row = [str(data_dict.get(key, "")) for key in keys]
+        if _id:
+            table.add_row(str(id_num), *row)
+        else:
+            table.add_row(*row)
     return table
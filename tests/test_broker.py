@@ -76,6 +76,24 @@ def test_broker_checkin_n_sync_empty_hostname():
     assert not broker_inst.from_inventory(), "Host was not removed from inventory after checkin"
 
 
+def test_broker_checkin_named_host_without_hostname():
+    """Test that checking in a named host without a hostname only removes that host"""
+    broker_inst = broker.Broker(nick="test_nick")
+    broker_inst.checkout()
+    inventory = helpers.load_inventory(filter='@inv._broker_provider == "TestProvider"')
+    assert len(inventory) == 1
+    no_ip, other = dict(inventory[0]), dict(inventory[0])
+    no_ip.update(hostname=None, name="vm-no-ip")
+    other.update(hostname="other.example.com", name="other")
+    helpers.update_inventory(add=[no_ip, other], remove="test.host.example.com")
+    hosts = broker_inst.from_inventory(filter='@inv.name == "vm-no-ip"')
+    assert len(hosts) == 1
+    broker.Broker(hosts=hosts).checkin()
+    remaining = helpers.load_inventory(filter='@inv._broker_provider == "TestProvider"')
+    assert [host["name"] for host in remaining] == ["other"]
+    helpers.update_inventory(remove="other.example.com")
+
+
 def test_mp_checkout():
     """Test that broker can checkout multiple hosts using multiprocessing"""
     VM_COUNT = 50  # This is intentionaly made high to catch run condition that
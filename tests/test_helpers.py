@@ -73,20 +73,76 @@ def test_emitter(tmp_file):
     assert written == {"test": "value", "another": 5, "thing": 13}
 
 
+def test_emitter_keeps_state_in_memory(tmp_file):
+    """Test that emits build on the in-memory state and atomically replace the file"""
+    emitter = helpers.Emitter(tmp_file)
+    emitter(first=1)
+    tmp_file.write_text("{}")  # the file is only ever written, never read back
+    emitter(second=2)
+    assert json.loads(tmp_file.read_text()) == {"first": 1, "second": 2}
+    assert not tmp_file.with_suffix(".json.tmp").exists()
+
+
+def test_emitter_bad_emission(tmp_file):
+    """Test that an unserializable emission fails alone and doesn't break later emits"""
+    emitter = helpers.Emitter(tmp_file)
+    with pytest.raises(TypeError):
+        emitter(bad={1, 2})
+    emitter(return_code=0)
+    assert json.loads(tmp_file.read_text()) == {"return_code": 0}
+
+
+def test_emitter_mutated_value(tmp_file):
+    """Test that re-emitting a value changed in place is written, and earlier emits aren't"""
+    emitter = helpers.Emitter(tmp_file)
+    hosts = [{"hostname": "host1"}]
+    emitter(hosts=hosts)
+    hosts.append({"hostname": "host2"})
+    emitter(other=1)
+    assert json.loads(tmp_file.read_text())["hosts"] == [{"hostname": "host1"}]
+    emitter(hosts=hosts)
+    assert len(json.loads(tmp_file.read_text())["hosts"]) == 2
+
+
+def test_emitter_skips_unchanged(tmp_file):
+    """Test that emitting values already in the file doesn't rewrite it"""
+    emitter = helpers.Emitter(tmp_file)
+    emitter(test="value")
+    tmp_file.write_text("sentinel")
+    emitter(test="value")
+    assert tmp_file.read_text() == "sentinel"
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_emitter_output_format(tmp_file, monkeypatch, use_orjson):
+    """Test that the emit file handles keys the same with or without orjson"""
+    if not use_orjson:
+        monkeypatch.setattr(helpers, "orjson", None)
+    elif helpers.orjson is None:
+        pytest.skip("orjson is not installed")
+    emitter = helpers.Emitter(tmp_file)
+    emitter(counts={1: "x"}, name="test")
+    assert json.loads(tmp_file.read_text()) == {"counts": {"1": "x"}, "name": "test"}
+    # orjson only supports a 2 space indent, the stdlib default stays at 4
+    indent = " " * (2 if use_orjson else 4)
+    assert tmp_file.read_text().splitlines()[1] == f'{indent}"counts": {{'
+
+
 def test_lock_file_created(tmp_file):
     lock_file = helpers.FileLock(tmp_file)
     with lock_file:
         assert isinstance(lock_file.lock, Path)
         assert lock_file.lock.exists()
-    assert not lock_file.lock.exists()
+    # the lock is released, so it can be acquired again right away
+    with helpers.FileLock(tmp_file, timeout=0):
+        pass
 
 
 def test_lock_timeout(tmp_file):
-    tmp_lock = Path(f"{tmp_file}.lock")
-    tmp_lock.touch()
-    with pytest.raises(exceptions.BrokerError) as exc:
-        with helpers.FileLock(tmp_file, timeout=1):
-            pass
+    with helpers.FileLock(tmp_file):
+        with pytest.raises(exceptions.BrokerError) as exc:
+            with helpers.FileLock(tmp_file, timeout=1):
+                pass
     assert str(exc.value).startswith("Timeout while waiting for lock release: ")
 
 
@@ -152,6 +208,16 @@ def test_eval_filter_chain(fake_inventory):
     assert len(filtered) == 1
 
 
+def test_eval_filter_plain_subscript(fake_inventory):
+    """Test that unwrapped subscript filters return copies and nested lookups still wrap"""
+    filtered = helpers.eval_filter(fake_inventory, "@inv[-1]")
+    assert filtered == [fake_inventory[-1]]
+    assert filtered[0] is not fake_inventory[-1]
+    # a lookup past the index relies on MockStub returning itself for missing keys
+    filtered = helpers.eval_filter(fake_inventory, '@inv[0]["not-a-key"]')
+    assert filtered == [fake_inventory[0]]
+
+
 def test_dict_from_paths_nested():
     source_dict = {
         "person": {
@@ -172,3 +238,124 @@ def test_kwargs_from_click_ctx():
 
     kwargs = helpers.kwargs_from_click_ctx(ctx)
     assert kwargs == {"arg1": "value1", "arg2": "value2"}
+
+
+def test_simple_retry_returns_result(monkeypatch):
+    """Test that a command succeeding after retries has its result returned"""
+    monkeypatch.setattr(helpers.time, "sleep", lambda _: None)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ValueError("not yet")
+        return "done"
+
+    assert helpers.simple_retry(flaky) == "done"
+    assert len(attempts) == 3
+
+
+def test_load_file_cache(tmp_path):
+    """Test that cached file loads are isolated copies and pick up file changes"""
+    data_file = tmp_path / "data.yaml"
+    data_file.write_text("key: value\n")
+    first = helpers.load_file(data_file)
+    first["key"] = "changed"
+    assert helpers.load_file(data_file) == {"key": "value"}
+    data_file.write_text("key: new value\n")
+    assert helpers.load_file(data_file) == {"key": "new value"}
+
+
+def test_mockstub_member_named_keys():
+    """Test that data keys named like mapping methods shadow them, as attributes"""
+    stub = helpers.MockStub({"items": "VAL", "keys": {"nested": 1}, "get": [{"deep": 2}]})
+    assert stub.items == "VAL"
+    assert stub.keys.nested == 1
+    assert stub.get[0].deep == 2
+    assert stub["items"] == "VAL"
+    inventory = [{"name": "host1", "keys": {"a": 1}}, {"name": "host2", "keys": {"a": 2}}]
+    assert helpers.eval_filter(inventory, "@inv.keys.a == 1") == [inventory[0]]
+
+
+def test_mockstub_hash_tracks_changes():
+    """Test that a MockStub's cached hash is dropped when its items change"""
+    stub = helpers.MockStub({"name": "host1", "nested": {"key": "value"}})
+    assert hash(stub) == hash(helpers.MockStub({"name": "host1"}))
+    stub["name"] = "host2"
+    assert hash(stub) == hash(helpers.MockStub({"name": "host2"}))
+
+
+@pytest.fixture
+def tmp_inventory(tmp_path, monkeypatch):
+    inventory = tmp_path / "inventory.yaml"
+    monkeypatch.setattr(helpers.settings, "inventory_path", inventory)
+    return inventory
+
+
+def test_update_inventory_write(tmp_inventory, monkeypatch):
+    """Test that inventory writes leave no temp files behind, even when the dump fails"""
+    helpers.update_inventory(add={"hostname": "host1"})
+    assert helpers.load_inventory() == [{"hostname": "host1"}]
+    assert list(tmp_inventory.parent.iterdir()) == [tmp_inventory]
+
+    def broken_dump(*args, **kwargs):
+        raise RuntimeError("dump failed")
+
+    monkeypatch.setattr(helpers.yaml, "dump", broken_dump)
+    with pytest.raises(RuntimeError):
+        helpers.update_inventory(add={"hostname": "host2"})
+    assert list(tmp_inventory.parent.iterdir()) == [tmp_inventory]
+    assert helpers.load_inventory() == [{"hostname": "host1"}]
+
+
+def test_update_inventory_remove(tmp_inventory):
+    """Test that hosts are removed by hostname or name, and a None only matches unnamed hosts"""
+    helpers.update_inventory(
+        add=[
+            {"hostname": "host1", "_broker_args": {}},
+            {"name": "container1"},
+            {"hostname": "host2"},
+            {"hostname": None, "name": None},
+            {"name": "container2"},
+        ]
+    )
+    helpers.update_inventory(remove=["host1", "container1", None])
+    assert helpers.load_inventory() == [{"hostname": "host2"}, {"name": "container2"}]
+
+
+def test_update_inventory_replace(tmp_inventory):
+    """Test that a re-added host keeps its old data without merging in unrelated hosts"""
+    helpers.update_inventory(
+        add=[{"hostname": "host1", "os": "rhel"}, {"name": "container1", "image": "ubi"}]
+    )
+    helpers.update_inventory(add={"hostname": "host1", "arch": "x86"}, remove="host1")
+    assert helpers.load_inventory() == [
+        {"name": "container1", "image": "ubi"},
+        {"hostname": "host1", "arch": "x86", "os": "rhel"},
+    ]
+
+
+def test_yaml_format_json_scalars():
+    """Test that json scalars are still parsed as json, and not forced into a dict"""
+    assert helpers.yaml_format("123", force_yaml_dict=True) == "123\n...\n"
+    assert helpers.yaml_format('{"key": "value"}') == "key: value\n"
+    assert helpers.yaml_format("key: value", force_yaml_dict=True) == "key: value\n"
+
+
+def test_inventory_fields_to_dict(monkeypatch):
+    """Test priority, combined, nested and late-registered special inventory fields"""
+    host = {"name": "host1", "os": {"distro": {"name": "RHEL"}}, "version": "9.4"}
+    fields = {
+        "Host": "hostname | name",
+        "OS": "os.distro.name version",
+        "Missing": "os.arch",
+        "Special": "$late",
+    }
+    assert helpers.inventory_fields_to_dict(fields, host)["Special"] == "Unknown"
+    monkeypatch.setitem(helpers.SPECIAL_INVENTORY_FIELDS, "$late", lambda host_dict, **_: "late")
+    assert helpers.inventory_fields_to_dict(fields, host) == {
+        "Host": "host1",
+        "OS": "RHEL 9.4",
+        "Missing": "Unknown",
+        "Special": "late",
+    }